@@ -0,0 +1,130 @@
+"""
+Buffered audit trail writes.
+
+Audit records are appended to an in-memory buffer on the request path and
+handed to a sink in batches by a background task, so the persistent store
+(in-memory today, a DB in production) sees one write per batch instead of
+one per event.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+from .models import AuditRecord
+
+logger = logging.getLogger("audit")
+
+
+@dataclass
+class AuditBuffer:
+    """
+    Batches audit records for a sink.
+
+    Records are flushed every `flush_interval` seconds by `run()`, or
+    early once `flush_threshold` are pending. If `run()` is not keeping
+    up (or not running), the buffer flushes inline at `max_pending` so
+    records are never dropped.
+
+    If the sink raises, the batch stays pending and is retried on the next
+    flush (so a sink that fails part-way may see some records twice). The
+    background flusher logs the failure and keeps running; an inline flush
+    at `max_pending` lets the error propagate to the writer.
+
+    Pending records are indexed by serial number, so reading or dropping
+    one device's records never scans the rest of the buffer.
+
+    Parameters:
+        sink: receives each non-empty batch, grouped by device and oldest
+            first within each device
+        flush_interval: seconds between background flushes
+        flush_threshold: pending count that wakes the flusher early
+        max_pending: pending count that forces an inline flush
+    """
+
+    sink: Callable[[list[AuditRecord]], None]
+    flush_interval: float = 1.0
+    flush_threshold: int = 500
+    max_pending: int = 10_000
+
+    _pending: dict[str, deque[AuditRecord]] = field(default_factory=dict)
+    _size: int = 0
+    # Created by run() so it belongs to the loop that waits on it; None
+    # until a flusher is running.
+    _signal: asyncio.Event | None = field(default=None, init=False, repr=False)
+
+    def append(self, record: AuditRecord) -> None:
+        """Queue one record for the next batch."""
+        self._add(record)
+        self._after_write()
+
+    def extend(self, records: Iterable[AuditRecord]) -> None:
+        """Queue several records with a single threshold check."""
+        for record in records:
+            self._add(record)
+        self._after_write()
+
+    def flush(self) -> int:
+        """Hand everything pending to the sink in one batch; kept if the sink raises."""
+        if not self._pending:
+            return 0
+        records = [r for device_records in self._pending.values() for r in device_records]
+        self.sink(records)
+        # Only once the sink has taken them; nothing can be appended meanwhile
+        # since the sink call is synchronous.
+        self._pending, self._size = {}, 0
+        logger.debug("AUDIT_FLUSH | records=%d", len(records))
+        return len(records)
+
+    async def run(self) -> None:
+        """Flush every interval, or early when signalled. Runs until cancelled."""
+        signal = self._signal = asyncio.Event()
+        if self._size >= self.flush_threshold:
+            signal.set()
+        try:
+            while True:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(signal.wait(), self.flush_interval)
+                signal.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("AUDIT_FLUSH | sink failed, %d records kept for retry", self._size)
+        finally:
+            if self._signal is signal:
+                self._signal = None
+
+    def pending_for(self, serial_number: str) -> list[AuditRecord]:
+        """Records for a device that have not been flushed yet."""
+        return list(self._pending.get(serial_number, ()))
+
+    def discard(self, serial_number: str) -> int:
+        """Drop a device's pending records; returns how many were dropped."""
+        removed = len(self._pending.pop(serial_number, ()))
+        self._size -= removed
+        return removed
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, record: AuditRecord) -> None:
+        device_records = self._pending.get(record.serial_number)
+        if device_records is None:
+            device_records = self._pending[record.serial_number] = deque()
+        device_records.append(record)
+        self._size += 1
+
+    def _after_write(self) -> None:
+        if self._size >= self.max_pending:
+            self.flush()
+        elif self._size >= self.flush_threshold and self._signal is not None:
+            self._signal.set()
@@ -18,13 +18,28 @@ Dashboard:
 
 from __future__ import annotations
 
+import asyncio
+import itertools
+import json
 import logging
-import uuid
-from datetime import datetime, timezone
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from collections.abc import Iterator, MutableMapping
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Mapping, NamedTuple
+
+import orjson
 
 from fastapi import FastAPI, HTTPException, Request, APIRouter
-from fastapi.responses import HTMLResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 
 from .models import (
     AuditRecord,
@@ -35,8 +50,10 @@ from .models import (
     EventType,
     PolicyConfirmation,
     PolicyResponse,
+    PolicyTemplate,
     VALID_TRANSITIONS,
 )
+from .audit import AuditBuffer
 from .safety import circuit_breaker
 
 # ── Structured logging ─────────────────────────────────────────────────
@@ -48,72 +65,302 @@ logging.basicConfig(
 )
 logger = logging.getLogger("dpc-backend")
 
-app = FastAPI(title="Device Finance Platform", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the background maintenance tasks; drain the audit buffer on shutdown."""
+    loop = asyncio.get_running_loop()
+    logger.info("STARTUP | event_loop=%s.%s", type(loop).__module__, type(loop).__qualname__)
+    tasks = [asyncio.create_task(audit_buffer.run()), asyncio.create_task(_command_gc_loop())]
+    yield
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    audit_buffer.flush()
+
+
+app = FastAPI(
+    title="Device Finance Platform",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+# Audit trails and command backlogs are large, repetitive JSON; small
+# bodies (policy, event acks) stay below the threshold and go out as-is.
+# Streamed responses are always compressed, so _stream_json only streams
+# lists longer than one chunk.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 api = APIRouter(prefix="/api")
 
 # ── In-memory stores (swap for DB in production) ──────────────────────
+#
+# Only the async handlers and background tasks touch these, all on the
+# event loop thread, so plain dicts need neither locks nor sharding.
+
+class DeviceStore(MutableMapping[str, DeviceState]):
+    """
+    serial_number -> current state, with a reverse index of serials per
+    state so callers can reach e.g. every locked device without scanning
+    the whole fleet. Each per-state index is an insertion-ordered dict
+    used as a set.
+    """
+
+    def __init__(self) -> None:
+        self._states: dict[str, DeviceState] = {}
+        self._by_state: dict[DeviceState, dict[str, None]] = {s: {} for s in DeviceState}
+
+    def __getitem__(self, sn: str) -> DeviceState:
+        return self._states[sn]
+
+    def __setitem__(self, sn: str, state: DeviceState) -> None:
+        old = self._states.get(sn)
+        if old is not None:
+            self._by_state[old].pop(sn, None)
+        self._states[sn] = state
+        self._by_state[state][sn] = None
+
+    def __delitem__(self, sn: str) -> None:
+        state = self._states.pop(sn)
+        self._by_state[state].pop(sn, None)
 
-devices: dict[str, DeviceState] = {}         # serial_number -> current state
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._states)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, sn: object) -> bool:
+        return sn in self._states
+
+    def get(self, sn: str, default=None):
+        return self._states.get(sn, default)
+
+    def items(self):
+        return self._states.items()
+
+    def clear(self) -> None:
+        self._states.clear()
+        for serials in self._by_state.values():
+            serials.clear()
+
+    def serials_in(self, state: DeviceState) -> list[str]:
+        """Serials currently in `state`, in the order they entered it."""
+        return list(self._by_state[state])
+
+
+devices = DeviceStore()                      # serial_number -> current state
 custom_messages: dict[str, str] = {}         # serial_number -> custom lock_screen_message
-audit_log: list[AuditRecord] = []
-command_queue: list[CommandEntry] = []
-confirmations: list[dict] = []
-processed_txns: set[str] = set()             # idempotency set
+audit_by_serial: dict[str, deque[AuditRecord]] = {}      # serial_number -> audit trail
+commands_by_serial: dict[str, deque[CommandEntry]] = {}  # serial_number -> queued commands
+commands_by_id: dict[str, CommandEntry] = {}             # command id -> entry
+confirmations_by_serial: dict[str, list[dict]] = {}     # serial_number -> DPC confirmations
+processed_txns: OrderedDict[str, float] = OrderedDict()  # txn id -> first applied (monotonic)
+
+# Per-device retention: both stores are ring buffers, so the oldest entries
+# fall off instead of growing for the life of the process. Audit depth and
+# the acknowledged-command TTL can be tuned per deployment.
+def _positive_int_env(name: str, default: int) -> int:
+    """Read a tuning knob from the environment; fail at startup if it is below 1."""
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer >= 1, got {raw!r}") from None
+    if value < 1:
+        raise ValueError(f"{name} must be an integer >= 1, got {raw!r}")
+    return value
+
+
+AUDIT_MAX_PER_DEVICE = _positive_int_env("AUDIT_TRAIL_MAX_ENTRIES", 10_000)
+COMMANDS_MAX_PER_DEVICE = 1_000
+COMMAND_TTL_SECONDS = _positive_int_env("COMMAND_QUEUE_TTL_SECONDS", 3600)
+COMMAND_GC_INTERVAL = 60.0      # seconds between prune passes
+TXN_LRU_MAX = 100_000           # transaction ids remembered for idempotency
+TXN_RETENTION_SECONDS = 86_400  # retries this long after the first apply are not deduplicated
+STREAM_CHUNK_SIZE = 500         # items serialized per chunk of a streamed list
+
+# Command ids: a random per-process prefix plus a counter. Unique for the
+# life of the in-memory stores without a urandom read per command.
+_CMD_ID_PREFIX = secrets.token_hex(4)
+_cmd_ids = itertools.count()
+
+
+def _persist_audit(records: list[AuditRecord]) -> None:
+    """Audit buffer sink: append a flushed batch to the per-device trails."""
+    for r in records:
+        trail = audit_by_serial.get(r.serial_number)
+        if trail is None:
+            trail = audit_by_serial[r.serial_number] = deque(maxlen=AUDIT_MAX_PER_DEVICE)
+        trail.append(r)
+
+
+# Request path appends here; records reach audit_by_serial in batches.
+audit_buffer = AuditBuffer(sink=_persist_audit)
 
 
 # ── Policy templates per state ─────────────────────────────────────────
 
-POLICY_TEMPLATES: dict[DeviceState, dict] = {
-    DeviceState.ACTIVE: {
-        "restrictions": {"no_usb": False, "no_camera": False, "no_install_apps": False},
-        "lock_screen_message": "",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.GRACE_PERIOD: {
-        "restrictions": {"no_usb": False, "no_camera": False, "no_install_apps": False},
-        "lock_screen_message": "Payment overdue. Please pay to avoid restrictions.",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.SOFT_LOCKED: {
-        "restrictions": {"no_usb": True, "no_camera": True, "no_install_apps": True},
-        "lock_screen_message": "Device restricted due to missed payment. Pay now to restore access.",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.HARD_LOCKED: {
-        "restrictions": {"no_usb": True, "no_camera": True, "no_install_apps": True},
-        "lock_screen_message": "Device locked. Contact support or make payment to unlock.",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.SUSPENDED: {
-        "restrictions": {"no_usb": True, "no_camera": True, "no_install_apps": True},
-        "lock_screen_message": "Device suspended. Contact support.",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.STOLEN_LOCKED: {
-        "restrictions": {"no_usb": True, "no_camera": True, "no_install_apps": True},
-        "lock_screen_message": "This device has been reported. Contact authorities.",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.PAID_OFF: {
-        "restrictions": {"no_usb": False, "no_camera": False, "no_install_apps": False},
-        "lock_screen_message": "",
-        "protected_packages": [],
-    },
-    DeviceState.PROVISIONING: {
-        "restrictions": {"no_usb": True, "no_camera": False, "no_install_apps": True},
-        "lock_screen_message": "Setup in progress.",
-        "protected_packages": ["com.example.fintechapp"],
-    },
-    DeviceState.DECOMMISSIONED: {
-        "restrictions": {},
-        "lock_screen_message": "Device decommissioned.",
-        "protected_packages": [],
-    },
+# Restriction sets are shared read-only views: every template and every
+# queued command for a given set points at the same object.
+_UNRESTRICTED = MappingProxyType({"no_usb": False, "no_camera": False, "no_install_apps": False})
+_RESTRICTED = MappingProxyType({"no_usb": True, "no_camera": True, "no_install_apps": True})
+_SETUP_RESTRICTIONS = MappingProxyType({"no_usb": True, "no_camera": False, "no_install_apps": True})
+_NO_RESTRICTIONS = MappingProxyType({})
+
+_PROTECTED = ("com.example.fintechapp",)
+
+POLICY_TEMPLATES: dict[DeviceState, PolicyTemplate] = {
+    DeviceState.ACTIVE: PolicyTemplate(
+        restrictions=_UNRESTRICTED,
+        lock_screen_message="",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.GRACE_PERIOD: PolicyTemplate(
+        restrictions=_UNRESTRICTED,
+        lock_screen_message="Payment overdue. Please pay to avoid restrictions.",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.SOFT_LOCKED: PolicyTemplate(
+        restrictions=_RESTRICTED,
+        lock_screen_message="Device restricted due to missed payment. Pay now to restore access.",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.HARD_LOCKED: PolicyTemplate(
+        restrictions=_RESTRICTED,
+        lock_screen_message="Device locked. Contact support or make payment to unlock.",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.SUSPENDED: PolicyTemplate(
+        restrictions=_RESTRICTED,
+        lock_screen_message="Device suspended. Contact support.",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.STOLEN_LOCKED: PolicyTemplate(
+        restrictions=_RESTRICTED,
+        lock_screen_message="This device has been reported. Contact authorities.",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.PAID_OFF: PolicyTemplate(
+        restrictions=_UNRESTRICTED,
+        lock_screen_message="",
+    ),
+    DeviceState.PROVISIONING: PolicyTemplate(
+        restrictions=_SETUP_RESTRICTIONS,
+        lock_screen_message="Setup in progress.",
+        protected_packages=_PROTECTED,
+    ),
+    DeviceState.DECOMMISSIONED: PolicyTemplate(
+        restrictions=_NO_RESTRICTIONS,
+        lock_screen_message="Device decommissioned.",
+    ),
+}
+
+# States released by the emergency mass unlock, in the order they are
+# visited (a tuple, so the unlocked_devices order is stable).
+_LOCKED_STATES: tuple[DeviceState, ...] = (
+    DeviceState.SOFT_LOCKED,
+    DeviceState.HARD_LOCKED,
+    DeviceState.SUSPENDED,
+)
+
+# Command the DPC should execute on entering each state.
+_STATE_TO_COMMAND: dict[DeviceState, CommandType | None] = {
+    DeviceState.ACTIVE: CommandType.UNLOCK,
+    DeviceState.GRACE_PERIOD: None,  # warning only, no device command
+    DeviceState.SOFT_LOCKED: CommandType.LOCK,
+    DeviceState.HARD_LOCKED: CommandType.LOCK,
+    DeviceState.SUSPENDED: CommandType.LOCK,
+    DeviceState.STOLEN_LOCKED: CommandType.LOCK,
+    DeviceState.PAID_OFF: CommandType.UNLOCK,
+    DeviceState.DECOMMISSIONED: CommandType.WIPE,
+}
+
+# Lock transitions gated by the circuit breaker.
+_BREAKER_STATES: tuple[DeviceState, ...] = (DeviceState.SOFT_LOCKED, DeviceState.HARD_LOCKED)
+
+
+class _Transition(NamedTuple):
+    """Everything handle_event needs to apply one (state, event) transition."""
+    to_state: DeviceState
+    command: CommandType | None             # queued for the DPC, if any
+    restrictions: Mapping[str, bool]        # payload of that command
+    breaker_gated: bool
+
+
+def _compile_transition(to_state: DeviceState) -> _Transition:
+    return _Transition(
+        to_state=to_state,
+        command=_STATE_TO_COMMAND.get(to_state),
+        restrictions=POLICY_TEMPLATES[to_state].restrictions,
+        breaker_gated=to_state in _BREAKER_STATES,
+    )
+
+
+# Transition table compiled from VALID_TRANSITIONS: one row per source
+# state, so an event costs a single row lookup with no (state, event)
+# tuple and no further template/command lookups. admin.decommission is
+# valid from any state and is folded into every row.
+_TRANSITIONS: dict[DeviceState, dict[EventType, _Transition]] = {
+    state: {
+        **{
+            event: _compile_transition(to)
+            for (frm, event), to in VALID_TRANSITIONS.items() if frm is state
+        },
+        EventType.ADMIN_DECOMMISSION: _compile_transition(DeviceState.DECOMMISSIONED),
+    }
+    for state in DeviceState
+}
+
+# PolicyResponse bodies per state, minus serial_number; built once at import.
+_POLICY_CACHE: dict[DeviceState, dict] = {
+    state: {
+        "device_state": state.value,
+        "restrictions": dict(template.restrictions),
+        "lock_screen_message": template.lock_screen_message,
+        "protected_packages": list(template.protected_packages),
+    }
+    for state, template in POLICY_TEMPLATES.items()
 }
 
+# /api/transitions body; the table is static, so it is encoded once at import.
+_TRANSITIONS_JSON: bytes = orjson.dumps({
+    from_state.value: [
+        {"event": event_type.value, "to_state": to_state.value}
+        for (frm, event_type), to_state in VALID_TRANSITIONS.items() if frm is from_state
+    ]
+    for from_state in dict.fromkeys(frm for frm, _ in VALID_TRANSITIONS)
+})
+
+# get_commands body for a device with nothing pending; %b is the JSON serial.
+_NO_COMMANDS_JSON = b'{"serial_number":%b,"commands":[]}'
+
+
+def _inline_schema(model: type[BaseModel]) -> dict:
+    """JSON schema for `model` with its $defs inlined, for use in openapi_extra."""
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(defs[node["$ref"].rsplit("/", 1)[-1]])
+            return {k: resolve(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [resolve(v) for v in node]
+        return node
+
+    return resolve(schema)
+
 
 # ── Dashboard ─────────────────────────────────────────────────────────
 
+# Kept sync: reads from disk, so it runs in the threadpool instead of
+# blocking the event loop. All API handlers below only touch in-memory
+# stores and are declared async.
 @app.get("/", response_class=HTMLResponse)
 def dashboard():
     html_path = Path(__file__).parent / "static" / "index.html"
@@ -122,100 +369,114 @@ def dashboard():
 
 # ── API Endpoints ─────────────────────────────────────────────────────
 
-@api.post("/event", status_code=200)
-def handle_event(payload: EventPayload, request: Request):
+@api.post(
+    "/event",
+    status_code=200,
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": _inline_schema(EventPayload)}},
+    }},
+)
+async def handle_event(request: Request):
     """
     Accept a payment or lifecycle event and transition device state.
-    Idempotent: duplicate transaction_ids are no-ops.
+    Idempotent: duplicate transaction_ids are no-ops. Clients may also
+    send the id as an Idempotency-Key header, which lets retries of an
+    already-applied event return before the body is read or validated.
     """
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key and _is_duplicate_txn(idempotency_key):
+        logger.info("EVENT | DUPLICATE txn=%s (header) — skipped", idempotency_key)
+        return _duplicate(idempotency_key)
+
+    payload = await _read_event_payload(request)
+
     client_ip = request.client.host if request.client else "unknown"
     sn = payload.serial_number
+    txn_id = payload.transaction_id or idempotency_key
     logger.info(
-        f"EVENT | serial={sn} event={payload.event_type.value} "
-        f"actor={payload.actor} txn={payload.transaction_id} ip={client_ip}"
+        "EVENT | serial=%s event=%s actor=%s txn=%s ip=%s",
+        sn, payload.event_type.value, payload.actor, txn_id, client_ip,
     )
 
     # Idempotency check
-    if payload.transaction_id and payload.transaction_id in processed_txns:
-        logger.info(f"EVENT | DUPLICATE txn={payload.transaction_id} serial={sn} — skipped")
-        return {
-            "status": "duplicate",
-            "message": f"Transaction {payload.transaction_id} already processed",
-        }
-
+    if txn_id and _is_duplicate_txn(txn_id):
+        logger.info("EVENT | DUPLICATE txn=%s serial=%s — skipped", txn_id, sn)
+        return _duplicate(txn_id)
+
+    # No awaits from here to the end of the handler: the read-transition-write
+    # below runs without yielding to the event loop, so concurrent events
+    # for the same serial cannot interleave. Keep it that way, or add a
+    # per-serial lock, if this ever needs to await (e.g. a DB write).
     current_state = devices.get(sn, DeviceState.PROVISIONING)
 
-    # admin.decommission is valid from any state
-    if payload.event_type == EventType.ADMIN_DECOMMISSION:
-        new_state = DeviceState.DECOMMISSIONED
-    else:
-        key = (current_state, payload.event_type)
-        if key not in VALID_TRANSITIONS:
-            logger.warning(
-                f"EVENT | REJECTED serial={sn} invalid transition: "
-                f"{current_state.value} + {payload.event_type.value}"
-            )
-            raise HTTPException(
-                status_code=409,
-                detail=f"Invalid transition: {current_state.value} + {payload.event_type.value}",
-            )
-        new_state = VALID_TRANSITIONS[key]
+    transition = _TRANSITIONS[current_state].get(payload.event_type)
+    if transition is None:
+        logger.warning(
+            "EVENT | REJECTED serial=%s invalid transition: %s + %s",
+            sn, current_state.value, payload.event_type.value,
+        )
+        raise HTTPException(
+            status_code=409,
+            detail=f"Invalid transition: {current_state.value} + {payload.event_type.value}",
+        )
+    new_state = transition.to_state
 
     # Circuit breaker: check before applying lock transitions
-    if new_state in (DeviceState.SOFT_LOCKED, DeviceState.HARD_LOCKED):
-        if not circuit_breaker.allow_lock():
+    if transition.breaker_gated:
+        if not circuit_breaker.check_and_record():
             logger.critical(
-                f"EVENT | CIRCUIT_BREAKER_BLOCKED serial={sn} "
-                f"attempted {current_state.value} -> {new_state.value}"
+                "EVENT | CIRCUIT_BREAKER_BLOCKED serial=%s attempted %s -> %s",
+                sn, current_state.value, new_state.value,
             )
             raise HTTPException(
                 status_code=503,
                 detail="Circuit breaker OPEN — lock operations halted. Contact on-call.",
             )
-        circuit_breaker.record_lock()
 
     # Apply transition
     devices[sn] = new_state
 
     logger.info(
-        f"TRANSITION | serial={sn} {current_state.value} -> {new_state.value} "
-        f"event={payload.event_type.value} actor={payload.actor}"
+        "TRANSITION | serial=%s %s -> %s event=%s actor=%s",
+        sn, current_state.value, new_state.value, payload.event_type.value, payload.actor,
     )
 
-    # Audit
+    # Audit and command share one timestamp
+    now = datetime.now(timezone.utc)
     record = AuditRecord(
         serial_number=sn,
         from_state=current_state,
         to_state=new_state,
         event=payload.event_type,
         actor=payload.actor,
-        timestamp=datetime.now(timezone.utc),
-        transaction_id=payload.transaction_id,
+        timestamp=now,
+        transaction_id=txn_id,
     )
-    audit_log.append(record)
+    audit_buffer.append(record)
 
     # Enqueue command to device
-    cmd = _state_to_command(new_state)
+    cmd = transition.command
     if cmd:
         entry = CommandEntry(
-            id=str(uuid.uuid4()),
+            id=f"{_CMD_ID_PREFIX}-{next(_cmd_ids):x}",
             serial_number=sn,
             command=cmd,
-            payload=POLICY_TEMPLATES.get(new_state, {}).get("restrictions", {}),
-            created_at=datetime.now(timezone.utc),
+            payload=transition.restrictions,
+            created_at=now,
         )
-        command_queue.append(entry)
-        logger.info(f"COMMAND | serial={sn} queued={cmd.value} id={entry.id}")
+        _enqueue_command(entry)
+        logger.info("COMMAND | serial=%s queued=%s id=%s", sn, cmd.value, entry.id)
 
     # Store or clear custom lock screen message
     if payload.custom_message:
         custom_messages[sn] = payload.custom_message
-        logger.info(f"EVENT | serial={sn} custom_message set: {payload.custom_message}")
+        logger.info("EVENT | serial=%s custom_message set: %s", sn, payload.custom_message)
     elif new_state in (DeviceState.ACTIVE, DeviceState.PAID_OFF):
         custom_messages.pop(sn, None)
 
-    if payload.transaction_id:
-        processed_txns.add(payload.transaction_id)
+    if txn_id:
+        _remember_txn(txn_id)
 
     return {
         "status": "ok",
@@ -227,75 +488,87 @@ def handle_event(payload: EventPayload, request: Request):
 
 
 @api.get("/policy/{serial_number}", response_model=PolicyResponse)
-def get_policy(serial_number: str):
+async def get_policy(serial_number: str):
     """Return the current policy payload for a device."""
     state = devices.get(serial_number)
     if state is None:
-        logger.warning(f"POLICY | serial={serial_number} NOT_FOUND")
+        logger.warning("POLICY | serial=%s NOT_FOUND", serial_number)
         raise HTTPException(status_code=404, detail=f"Device {serial_number} not found")
 
-    template = POLICY_TEMPLATES.get(state, POLICY_TEMPLATES[DeviceState.ACTIVE])
-    lock_message = custom_messages.get(serial_number, template["lock_screen_message"])
-    logger.info(f"POLICY | serial={serial_number} state={state.value} restrictions={template['restrictions']}")
-    return PolicyResponse(
-        serial_number=serial_number,
-        device_state=state,
-        restrictions=template["restrictions"],
-        lock_screen_message=lock_message,
-        protected_packages=template["protected_packages"],
+    policy = {"serial_number": serial_number, **_POLICY_CACHE[state]}
+    custom_message = custom_messages.get(serial_number)
+    if custom_message is not None:
+        policy["lock_screen_message"] = custom_message
+    logger.info(
+        "POLICY | serial=%s state=%s restrictions=%s",
+        serial_number, state.value, policy["restrictions"],
     )
+    # Returned as a response directly: the payload is prebuilt, so skip
+    # PolicyResponse validation (response_model is kept for the schema).
+    # Policy only changes on a state transition; a 1s private cache lets
+    # back-to-back polls from the same client skip the round trip.
+    return ORJSONResponse(policy, headers={"Cache-Control": "private, max-age=1"})
 
 
 @api.get("/commands/{serial_number}")
-def get_commands(serial_number: str):
+async def get_commands(serial_number: str):
     """Return pending (unacknowledged) commands for a device."""
-    pending = [c for c in command_queue if c.serial_number == serial_number and not c.acknowledged]
-    logger.info(f"COMMANDS | serial={serial_number} pending={len(pending)}")
-    return {"serial_number": serial_number, "commands": [c.model_dump() for c in pending]}
+    queue = commands_by_serial.get(serial_number)
+    pending = [c for c in queue if not c.acknowledged] if queue else []
+    logger.info("COMMANDS | serial=%s pending=%d", serial_number, len(pending))
+    if not pending:
+        # The common poll result; fill in the serial and skip the encoder.
+        return Response(_NO_COMMANDS_JSON % orjson.dumps(serial_number), media_type="application/json")
+    # Returned as a response directly so the cached dicts go straight to
+    # orjson without a jsonable_encoder pass.
+    return ORJSONResponse({"serial_number": serial_number, "commands": [c.as_dict() for c in pending]})
 
 
 @api.post("/commands/{command_id}/ack")
-def ack_command(command_id: str):
+async def ack_command(command_id: str):
     """Mark a command as acknowledged by the DPC."""
-    for c in command_queue:
-        if c.id == command_id:
-            c.acknowledged = True
-            logger.info(f"COMMAND_ACK | id={command_id} serial={c.serial_number} command={c.command.value}")
-            return {"status": "ok", "command_id": command_id}
-    raise HTTPException(status_code=404, detail="Command not found")
+    c = commands_by_id.get(command_id)
+    if c is None:
+        raise HTTPException(status_code=404, detail="Command not found")
+    c.acknowledge()
+    logger.info("COMMAND_ACK | id=%s serial=%s command=%s", command_id, c.serial_number, c.command.value)
+    return {"status": "ok", "command_id": command_id}
 
 
 @api.get("/audit/{serial_number}")
-def get_audit(serial_number: str):
-    """Return the full audit trail for a device."""
-    records = [r.model_dump() for r in audit_log if r.serial_number == serial_number]
-    logger.info(f"AUDIT | serial={serial_number} records={len(records)}")
-    return {"serial_number": serial_number, "records": records}
+async def get_audit(serial_number: str):
+    """Return the full audit trail for a device, streamed in chunks."""
+    records = _audit_records(serial_number)
+    logger.info("AUDIT | serial=%s records=%d", serial_number, len(records))
+    return _stream_json({"serial_number": serial_number}, "records", records, _audit_rows)
 
 
 @api.delete("/device/{serial_number}")
-def delete_device(serial_number: str):
+async def delete_device(serial_number: str):
     """
     Remove a device and all its associated data (state, audit, commands).
     """
     if serial_number not in devices:
-        logger.warning(f"DELETE | serial={serial_number} NOT_FOUND")
+        logger.warning("DELETE | serial=%s NOT_FOUND", serial_number)
         raise HTTPException(status_code=404, detail=f"Device {serial_number} not found")
 
     del devices[serial_number]
     custom_messages.pop(serial_number, None)
 
-    removed_audit = len([r for r in audit_log if r.serial_number == serial_number])
-    audit_log[:] = [r for r in audit_log if r.serial_number != serial_number]
+    removed_audit = len(audit_by_serial.pop(serial_number, ()))
+    removed_audit += audit_buffer.discard(serial_number)
 
-    removed_cmds = len([c for c in command_queue if c.serial_number == serial_number])
-    command_queue[:] = [c for c in command_queue if c.serial_number != serial_number]
+    cmds = commands_by_serial.pop(serial_number, ())
+    for c in cmds:
+        commands_by_id.pop(c.id, None)
+    removed_cmds = len(cmds)
 
     # Also remove confirmations
-    confirmations[:] = [c for c in confirmations if c.get("serial_number") != serial_number]
+    confirmations_by_serial.pop(serial_number, None)
 
     logger.info(
-        f"DELETE | serial={serial_number} removed audit_records={removed_audit} commands={removed_cmds}"
+        "DELETE | serial=%s removed audit_records=%d commands=%d",
+        serial_number, removed_audit, removed_cmds,
     )
     return {
         "status": "ok",
@@ -306,7 +579,7 @@ def delete_device(serial_number: str):
 
 
 @api.post("/confirm")
-def confirm_policy(payload: PolicyConfirmation):
+async def confirm_policy(payload: PolicyConfirmation):
     """
     DPC confirms that a policy change was applied (or failed) on the device.
     Only sent when the device detects a state transition.
@@ -319,49 +592,49 @@ def confirm_policy(payload: PolicyConfirmation):
         "details": payload.details,
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
-    confirmations.append(entry)
+    confirmations_by_serial.setdefault(payload.serial_number, []).append(entry)
     logger.info(
-        f"CONFIRM | serial={payload.serial_number} "
-        f"{payload.previous_state} -> {payload.new_state} "
-        f"success={payload.success} details={payload.details}"
+        "CONFIRM | serial=%s %s -> %s success=%s details=%s",
+        payload.serial_number, payload.previous_state, payload.new_state,
+        payload.success, payload.details,
     )
     return {"status": "ok", **entry}
 
 
 @api.get("/confirmations/{serial_number}")
-def get_confirmations(serial_number: str):
+async def get_confirmations(serial_number: str):
     """Return all policy confirmations for a device."""
-    entries = [c for c in confirmations if c["serial_number"] == serial_number]
+    entries = confirmations_by_serial.get(serial_number, [])
     return {"serial_number": serial_number, "confirmations": entries}
 
 
 @api.post("/admin/emergency-unlock")
-def emergency_unlock(reason: str = "emergency"):
+async def emergency_unlock(reason: str = "emergency"):
     """
     Gate 4 — Emergency mass unlock.
     Transitions ALL locked devices to ACTIVE.
     """
-    unlocked = []
-    locked_states = {DeviceState.SOFT_LOCKED, DeviceState.HARD_LOCKED, DeviceState.SUSPENDED}
-
-    for sn, state in list(devices.items()):
-        if state in locked_states:
-            old_state = state
-            devices[sn] = DeviceState.ACTIVE
-            audit_log.append(AuditRecord(
-                serial_number=sn,
-                from_state=old_state,
-                to_state=DeviceState.ACTIVE,
-                event=EventType.ADMIN_REINSTATE,
-                actor=f"emergency:{reason}",
-                timestamp=datetime.now(timezone.utc),
-            ))
-            unlocked.append(sn)
-            logger.info(f"EMERGENCY_UNLOCK | serial={sn} {old_state.value} -> ACTIVE reason={reason}")
+    to_unlock = [(sn, state) for state in _LOCKED_STATES for sn in devices.serials_in(state)]
+    unlocked = [sn for sn, _ in to_unlock]
+    devices.update(dict.fromkeys(unlocked, DeviceState.ACTIVE))
+
+    now = datetime.now(timezone.utc)
+    actor = f"emergency:{reason}"
+    audit_buffer.extend([
+        AuditRecord(
+            serial_number=sn,
+            from_state=old_state,
+            to_state=DeviceState.ACTIVE,
+            event=EventType.ADMIN_REINSTATE,
+            actor=actor,
+            timestamp=now,
+        )
+        for sn, old_state in to_unlock
+    ])
 
     circuit_breaker.reset()
 
-    logger.warning(f"EMERGENCY_UNLOCK | total={len(unlocked)} reason={reason}")
+    logger.warning("EMERGENCY_UNLOCK | total=%d reason=%s", len(unlocked), reason)
 
     return {
         "status": "ok",
@@ -372,28 +645,17 @@ def emergency_unlock(reason: str = "emergency"):
 
 
 @api.get("/devices")
-def list_devices():
-    """List all registered devices and their current state."""
-    device_list = [
-        {"serial_number": sn, "state": state.value}
-        for sn, state in devices.items()
-    ]
-    logger.info(f"DEVICES | total={len(device_list)}")
-    return {"devices": device_list, "total": len(device_list)}
+async def list_devices():
+    """List all registered devices and their current state, streamed in chunks."""
+    device_list = list(devices.items())
+    logger.info("DEVICES | total=%d", len(device_list))
+    return _stream_json({"total": len(device_list)}, "devices", device_list, _device_rows)
 
 
 @api.get("/transitions")
-def get_transitions():
+async def get_transitions():
     """Return all valid state transitions for the UI."""
-    result = {}
-    for (from_state, event_type), to_state in VALID_TRANSITIONS.items():
-        if from_state.value not in result:
-            result[from_state.value] = []
-        result[from_state.value].append({
-            "event": event_type.value,
-            "to_state": to_state.value,
-        })
-    return result
+    return Response(_TRANSITIONS_JSON, media_type="application/json")
 
 
 # Mount the API router
@@ -402,16 +664,178 @@ app.include_router(api)
 
 # ── Helpers ────────────────────────────────────────────────────────────
 
-def _state_to_command(state: DeviceState) -> CommandType | None:
-    """Map a device state to the command the DPC should execute."""
-    mapping = {
-        DeviceState.ACTIVE: CommandType.UNLOCK,
-        DeviceState.GRACE_PERIOD: None,  # warning only, no device command
-        DeviceState.SOFT_LOCKED: CommandType.LOCK,
-        DeviceState.HARD_LOCKED: CommandType.LOCK,
-        DeviceState.SUSPENDED: CommandType.LOCK,
-        DeviceState.STOLEN_LOCKED: CommandType.LOCK,
-        DeviceState.PAID_OFF: CommandType.UNLOCK,
-        DeviceState.DECOMMISSIONED: CommandType.WIPE,
-    }
-    return mapping.get(state)
+async def _read_event_payload(request: Request) -> EventPayload:
+    """
+    Parse and validate an event body, answering bad bodies the way a
+    FastAPI body parameter would: 422 for a missing body, a non-JSON
+    content type, malformed JSON or invalid fields; 400 for bytes that
+    are not text at all. The raw body is never echoed back in an error.
+
+    Well-formed bodies are validated straight from the bytes in
+    pydantic-core rather than json.loads() into a dict first.
+    """
+    body = await request.body()
+    if not body:
+        raise RequestValidationError(
+            [{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}]
+        )
+    content_type = request.headers.get("content-type")
+    if content_type and not _is_json_media_type(content_type):
+        raise RequestValidationError([{
+            "type": "model_attributes_type",
+            "loc": ("body",),
+            "msg": "Input should be a valid dictionary or object to extract fields from",
+            "input": None,
+        }])
+
+    try:
+        return EventPayload.model_validate_json(body)
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+    if any(err["type"] == "json_invalid" for err in errors):
+        # Error path only: re-parse with the stdlib to report what a body
+        # parameter would (decode position, or 400 for undecodable bytes).
+        try:
+            json.loads(body)
+        except json.JSONDecodeError as e:
+            raise RequestValidationError([{
+                "type": "json_invalid",
+                "loc": ("body", e.pos),
+                "msg": "JSON decode error",
+                "input": {},
+                "ctx": {"error": e.msg},
+            }])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="There was an error parsing the body")
+        # Accepted by the stdlib but not by pydantic (e.g. NaN)
+        errors = [{**err, "input": {}} for err in errors]
+    raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in errors])
+
+
+def _is_json_media_type(content_type: str) -> bool:
+    media_type = content_type.partition(";")[0].strip().lower()
+    maintype, _, subtype = media_type.partition("/")
+    return maintype == "application" and (subtype == "json" or subtype.endswith("+json"))
+
+
+def _duplicate(txn_id: str) -> dict:
+    return {"status": "duplicate", "message": f"Transaction {txn_id} already processed"}
+
+
+def _is_duplicate_txn(txn_id: str) -> bool:
+    """
+    True if the transaction was applied within TXN_RETENTION_SECONDS.
+
+    A hit does not extend retention: the window runs from the first
+    apply, so a steady stream of retries cannot keep an id alive forever.
+    An id past the window is forgotten here, even if no newer insert has
+    pushed it out yet, and the event is processed as new.
+    """
+    applied_at = processed_txns.get(txn_id)
+    if applied_at is None:
+        return False
+    if applied_at <= time.monotonic() - TXN_RETENTION_SECONDS:
+        del processed_txns[txn_id]
+        return False
+    return True
+
+
+def _remember_txn(txn_id: str) -> None:
+    """
+    Record a transaction id as applied now. Ids are kept in apply order,
+    so the ones past the retention window, or beyond TXN_LRU_MAX, are
+    dropped from the front.
+    """
+    now = time.monotonic()
+    processed_txns[txn_id] = now
+    processed_txns.move_to_end(txn_id)
+    cutoff = now - TXN_RETENTION_SECONDS
+    while processed_txns and (
+        len(processed_txns) > TXN_LRU_MAX or next(iter(processed_txns.values())) <= cutoff
+    ):
+        processed_txns.popitem(last=False)
+
+
+def _audit_records(serial_number: str) -> list[AuditRecord]:
+    """
+    Flushed plus still-buffered audit records for a device, oldest first,
+    capped at what the trail will hold once the buffer is flushed.
+    """
+    records = list(audit_by_serial.get(serial_number, ()))
+    records.extend(audit_buffer.pending_for(serial_number))
+    if len(records) > AUDIT_MAX_PER_DEVICE:
+        del records[:-AUDIT_MAX_PER_DEVICE]
+    return records
+
+
+def _enqueue_command(entry: CommandEntry) -> None:
+    """Queue a command for its device, evicting the oldest when the ring is full."""
+    queue = commands_by_serial.get(entry.serial_number)
+    if queue is None:
+        queue = commands_by_serial[entry.serial_number] = deque(maxlen=COMMANDS_MAX_PER_DEVICE)
+    elif len(queue) == queue.maxlen:
+        commands_by_id.pop(queue[0].id, None)
+    queue.append(entry)
+    commands_by_id[entry.id] = entry
+
+
+def _prune_commands(cutoff: datetime) -> int:
+    """Drop acknowledged commands created before `cutoff`."""
+    removed = 0
+    for sn, queue in list(commands_by_serial.items()):
+        kept = deque(maxlen=COMMANDS_MAX_PER_DEVICE)
+        for c in queue:
+            if c.acknowledged and c.created_at <= cutoff:
+                commands_by_id.pop(c.id, None)
+            else:
+                kept.append(c)
+        if len(kept) == len(queue):
+            continue
+        removed += len(queue) - len(kept)
+        if kept:
+            commands_by_serial[sn] = kept
+        else:
+            del commands_by_serial[sn]
+    return removed
+
+
+async def _command_gc_loop() -> None:
+    """Periodically prune acknowledged commands past their TTL."""
+    while True:
+        await asyncio.sleep(COMMAND_GC_INTERVAL)
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=COMMAND_TTL_SECONDS)
+        removed = _prune_commands(cutoff)
+        if removed:
+            logger.info("COMMAND_GC | removed=%d", removed)
+
+
+def _stream_json(
+    head: dict, key: str, items: list, dump: Callable[[list], list],
+) -> ORJSONResponse | StreamingResponse:
+    """
+    Send `{**head, key: items}` as JSON. Lists that fit in one chunk go out
+    as a plain response; longer ones are streamed, serializing `items` a
+    chunk at a time so they are never materialized as one encoded body.
+    `items` must be a snapshot: the stores can change between chunks.
+    """
+    if len(items) <= STREAM_CHUNK_SIZE:
+        # Sized body, so GZipMiddleware's minimum_size applies; it
+        # compresses every streamed body regardless of length.
+        return ORJSONResponse({**head, key: dump(items)})
+
+    async def body():
+        yield orjson.dumps(head)[:-1] + b',"' + key.encode() + b'":['
+        for start in range(0, len(items), STREAM_CHUNK_SIZE):
+            chunk = orjson.dumps(dump(items[start:start + STREAM_CHUNK_SIZE]))[1:-1]
+            yield chunk if start == 0 else b"," + chunk
+        yield b"]}"
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+def _audit_rows(records: list[AuditRecord]) -> list[dict]:
+    return [r.as_dict() for r in records]
+
+
+def _device_rows(items: list[tuple[str, DeviceState]]) -> list[dict]:
+    return [{"serial_number": sn, "state": state.value} for sn, state in items]
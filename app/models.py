@@ -3,9 +3,10 @@ Gate 3 — Data models and deterministic state machine.
 """
 
 from __future__ import annotations
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Mapping, Optional
 
 from pydantic import BaseModel, Field
 
@@ -75,6 +76,79 @@ VALID_TRANSITIONS: dict[tuple[DeviceState, EventType], DeviceState] = {
 # admin.decommission is valid from any state — handled specially in the engine.
 
 
+# ── Policy templates ───────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class PolicyTemplate:
+    """Static policy pushed to a device in a given state."""
+    restrictions: Mapping[str, bool]
+    lock_screen_message: str
+    protected_packages: tuple[str, ...] = ()
+
+
+# ── Internal records ───────────────────────────────────────────────────
+#
+# Built only by server code from already-validated input, and stored in
+# bulk, so these are slotted dataclasses rather than pydantic models: no
+# per-instance __dict__ and no validation on construction. Serialized via
+# as_dict(), which is memoized. Keyword-only, as the models they replaced
+# were.
+
+@dataclass(slots=True, kw_only=True)
+class CommandEntry:
+    id: str
+    serial_number: str
+    command: CommandType
+    payload: Mapping[str, Any] = field(default_factory=dict)  # may be a shared read-only view
+    created_at: datetime
+    acknowledged: bool = False
+    _dump: Optional[dict] = field(default=None, init=False, repr=False, compare=False)
+
+    def as_dict(self) -> dict:
+        """Serialized form, computed once and reused across polls."""
+        if self._dump is None:
+            self._dump = {
+                "id": self.id,
+                "serial_number": self.serial_number,
+                "command": self.command,
+                "payload": dict(self.payload),
+                "created_at": self.created_at,
+                "acknowledged": self.acknowledged,
+            }
+        return self._dump
+
+    def acknowledge(self) -> None:
+        self.acknowledged = True
+        if self._dump is not None:
+            self._dump["acknowledged"] = True
+
+
+@dataclass(slots=True, kw_only=True)
+class AuditRecord:
+    serial_number: str
+    from_state: DeviceState
+    to_state: DeviceState
+    event: EventType
+    actor: str
+    timestamp: datetime
+    transaction_id: Optional[str] = None
+    _dump: Optional[dict] = field(default=None, init=False, repr=False, compare=False)
+
+    def as_dict(self) -> dict:
+        """Serialized form, computed once; audit records never change."""
+        if self._dump is None:
+            self._dump = {
+                "serial_number": self.serial_number,
+                "from_state": self.from_state,
+                "to_state": self.to_state,
+                "event": self.event,
+                "actor": self.actor,
+                "timestamp": self.timestamp,
+                "transaction_id": self.transaction_id,
+            }
+        return self._dump
+
+
 # ── Request / Response schemas ─────────────────────────────────────────
 
 class EventPayload(BaseModel):
@@ -94,25 +168,6 @@ class PolicyResponse(BaseModel):
     protected_packages: list[str]
 
 
-class CommandEntry(BaseModel):
-    id: str
-    serial_number: str
-    command: CommandType
-    payload: dict = Field(default_factory=dict)
-    created_at: datetime
-    acknowledged: bool = False
-
-
-class AuditRecord(BaseModel):
-    serial_number: str
-    from_state: DeviceState
-    to_state: DeviceState
-    event: EventType
-    actor: str
-    timestamp: datetime
-    transaction_id: Optional[str] = None
-
-
 class PolicyConfirmation(BaseModel):
     serial_number: str = Field(..., min_length=1, max_length=64)
     previous_state: str
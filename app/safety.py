@@ -10,7 +10,9 @@ from __future__ import annotations
 
 import time
 import logging
+from array import array
 from dataclasses import dataclass, field
+from typing import Callable
 
 logger = logging.getLogger("safety")
 
@@ -24,22 +26,29 @@ class CircuitBreaker:
     """
     Sliding-window circuit breaker for lock operations.
 
-    Tracks the count of lock commands issued within a rolling time window.
-    If the count exceeds `max_locks_in_window`, the breaker trips OPEN
-    and all subsequent lock operations are blocked until manual reset
-    or the cooldown expires.
+    Tracks the count of lock commands issued within a rolling time window,
+    as a ring of per-second counters (one slot per second of the window),
+    so memory is fixed regardless of lock rate. A running total of the ring
+    is kept alongside it, so reading the count is O(1) rather than a sum
+    over the window. If the count exceeds `max_locks_in_window`, the
+    breaker trips OPEN and all subsequent lock operations are blocked until
+    manual reset or the cooldown expires.
 
     Parameters:
         max_locks_in_window: max lock commands allowed in the window
         window_seconds: size of the sliding window
         cooldown_seconds: auto-reset after this duration (0 = manual only)
+        time_fn: monotonic clock in seconds (injectable for tests)
     """
 
     max_locks_in_window: int = 50
     window_seconds: int = 300       # 5-minute window
     cooldown_seconds: int = 600     # 10-minute auto-reset
+    time_fn: Callable[[], float] = time.monotonic
 
-    _lock_timestamps: list[float] = field(default_factory=list)
+    _buckets: array = field(default_factory=lambda: array("i"))  # locks per second, ring
+    _last_second: int = field(default=0)                          # newest second in the ring
+    _count: int = field(default=0)                                # sum of _buckets
     _tripped_at: float | None = field(default=None)
     _state: str = field(default="CLOSED")  # CLOSED | OPEN
 
@@ -54,21 +63,33 @@ class CircuitBreaker:
 
     def record_lock(self) -> None:
         """Record a lock operation and trip if threshold exceeded."""
-        now = time.time()
-        self._lock_timestamps.append(now)
+        now = int(self.time_fn())
+        self._advance(now)
+        self._buckets[now % self.window_seconds] += 1
+        self._count += 1
 
-        # Trim timestamps outside the window
-        cutoff = now - self.window_seconds
-        self._lock_timestamps = [t for t in self._lock_timestamps if t > cutoff]
-
-        if len(self._lock_timestamps) >= self.max_locks_in_window:
+        if self._count >= self.max_locks_in_window:
             self._trip()
 
+    def check_and_record(self) -> bool:
+        """
+        allow_lock() and record_lock() in one call, for the event hot path.
+        Records the lock and returns True if permitted, else returns False.
+        """
+        if self._state == "OPEN":
+            self._maybe_auto_reset()
+            if self._state == "OPEN":
+                logger.warning("CIRCUIT_BREAKER | OPEN — lock denied")
+                return False
+        self.record_lock()
+        return True
+
     def reset(self) -> None:
         """Manually reset the circuit breaker to CLOSED."""
         self._state = "CLOSED"
         self._tripped_at = None
-        self._lock_timestamps.clear()
+        self._buckets = array("i")
+        self._count = 0
         logger.info("CIRCUIT_BREAKER | Manually reset to CLOSED")
 
     @property
@@ -78,16 +99,32 @@ class CircuitBreaker:
 
     @property
     def current_count(self) -> int:
-        now = time.time()
-        cutoff = now - self.window_seconds
-        return len([t for t in self._lock_timestamps if t > cutoff])
+        self._advance(int(self.time_fn()))
+        return self._count
+
+    def _advance(self, now: int) -> None:
+        """Zero the slots of seconds that have slid out of the window."""
+        size = self.window_seconds
+        elapsed = now - self._last_second
+        if len(self._buckets) != size or elapsed >= size:
+            # First use, window resized, or the whole window has expired
+            self._buckets = array("i", [0]) * size
+            self._count = 0
+            self._last_second = now
+        elif elapsed > 0:
+            buckets = self._buckets
+            for second in range(self._last_second + 1, now + 1):
+                slot = second % size
+                self._count -= buckets[slot]
+                buckets[slot] = 0
+            self._last_second = now
 
     def _trip(self) -> None:
         self._state = "OPEN"
-        self._tripped_at = time.time()
+        self._tripped_at = self.time_fn()
         logger.critical(
             f"CIRCUIT_BREAKER | TRIPPED OPEN — "
-            f"{len(self._lock_timestamps)} locks in {self.window_seconds}s window "
+            f"{self._count} locks in {self.window_seconds}s window "
             f"(threshold: {self.max_locks_in_window})"
         )
 
@@ -96,7 +133,7 @@ class CircuitBreaker:
             self._state == "OPEN"
             and self.cooldown_seconds > 0
             and self._tripped_at is not None
-            and time.time() - self._tripped_at > self.cooldown_seconds
+            and self.time_fn() - self._tripped_at > self.cooldown_seconds
         ):
             logger.info("CIRCUIT_BREAKER | Auto-reset after cooldown")
             self.reset()
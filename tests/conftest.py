@@ -0,0 +1,60 @@
+"""
+Shared fixtures — one TestClient for the session, and store seeding
+that skips the HTTP round trip for test setup.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import (
+    app,
+    audit_buffer,
+    audit_by_serial,
+    commands_by_id,
+    commands_by_serial,
+    confirmations_by_serial,
+    custom_messages,
+    devices,
+    processed_txns,
+)
+from app.models import DeviceState
+from app.safety import circuit_breaker
+
+from .helpers import SERIAL
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One client for the whole run; the app lifespan starts and stops once."""
+    with TestClient(app) as c:
+        yield c
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "no_reset: test only reads static routes; skip the store reset")
+
+
+@pytest.fixture(autouse=True)
+def reset_state(request):
+    """Empty every store and close the circuit breaker before each test."""
+    if request.node.get_closest_marker("no_reset"):
+        return
+    for store in (
+        devices,
+        custom_messages,
+        audit_buffer,
+        audit_by_serial,
+        commands_by_serial,
+        commands_by_id,
+        confirmations_by_serial,
+        processed_txns,
+    ):
+        store.clear()
+    circuit_breaker.reset()
+
+
+@pytest.fixture
+def active_device():
+    """SERIAL already enrolled, without going through /api/event."""
+    devices[SERIAL] = DeviceState.ACTIVE
+    return SERIAL
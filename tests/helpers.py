@@ -0,0 +1,5 @@
+"""
+Constants shared by the test modules and conftest fixtures.
+"""
+
+SERIAL = "EMULATOR30X1234"
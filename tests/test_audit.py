@@ -0,0 +1,123 @@
+"""
+Tests for the buffered audit trail writer.
+"""
+
+import asyncio
+from contextlib import suppress
+from datetime import datetime, timezone
+
+from app.audit import AuditBuffer
+from app.models import AuditRecord, DeviceState, EventType
+
+
+def _record(sn: str) -> AuditRecord:
+    return AuditRecord(
+        serial_number=sn,
+        from_state=DeviceState.ACTIVE,
+        to_state=DeviceState.GRACE_PERIOD,
+        event=EventType.PAYMENT_OVERDUE,
+        actor="test",
+        timestamp=datetime.now(timezone.utc),
+    )
+
+
+def test_flush_hands_batch_to_sink_grouped_by_device():
+    batches = []
+    buf = AuditBuffer(sink=batches.append)
+    first_a = _record("A")
+    buf.append(first_a)
+    buf.extend([_record("B"), _record("A"), _record("C")])
+    assert len(buf) == 4
+    assert buf.flush() == 4
+    assert [r.serial_number for r in batches[0]] == ["A", "A", "B", "C"]
+    assert batches[0][0] is first_a
+    assert buf.flush() == 0
+    assert len(batches) == 1
+
+
+def test_inline_flush_at_max_pending():
+    batches = []
+    buf = AuditBuffer(sink=batches.append, max_pending=2)
+    buf.append(_record("A"))
+    assert not batches
+    buf.append(_record("B"))
+    assert len(batches) == 1
+    assert len(buf) == 0
+
+
+def test_pending_for_and_discard():
+    buf = AuditBuffer(sink=lambda records: None)
+    buf.extend([_record("A"), _record("B"), _record("A")])
+    assert len(buf.pending_for("A")) == 2
+    assert buf.discard("A") == 2
+    assert buf.discard("A") == 0
+    assert [r.serial_number for r in buf.pending_for("B")] == ["B"]
+    assert buf.pending_for("A") == []
+    assert len(buf) == 1
+
+
+def test_run_flushes_early_at_threshold():
+    batches = []
+
+    async def scenario():
+        buf = AuditBuffer(sink=batches.append, flush_interval=60, flush_threshold=2)
+        task = asyncio.create_task(buf.run())
+        buf.append(_record("A"))
+        buf.append(_record("B"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert [len(b) for b in batches] == [2]
+
+
+def test_run_works_on_successive_event_loops():
+    batches = []
+    buf = AuditBuffer(sink=batches.append, flush_interval=60, flush_threshold=1)
+
+    async def scenario():
+        task = asyncio.create_task(buf.run())
+        await asyncio.sleep(0)
+        buf.append(_record("A"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+    # e.g. two app lifespans in one process
+    asyncio.run(scenario())
+    asyncio.run(scenario())
+    assert [len(b) for b in batches] == [1, 1]
+
+    # No flusher running: threshold writes just stay pending
+    buf.append(_record("B"))
+    assert len(buf) == 1
+
+
+def test_failing_sink_keeps_records_and_flusher_alive():
+    batches = []
+    failures = [RuntimeError("db down")]
+
+    def sink(records):
+        if failures:
+            raise failures.pop()
+        batches.append(records)
+
+    async def scenario():
+        buf = AuditBuffer(sink=sink, flush_interval=60, flush_threshold=1)
+        task = asyncio.create_task(buf.run())
+        await asyncio.sleep(0)
+        buf.append(_record("A"))
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        assert len(buf) == 1            # kept for retry
+        buf.append(_record("B"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        return buf
+
+    buf = asyncio.run(scenario())
+    assert [[r.serial_number for r in b] for b in batches] == [["A", "B"]]
+    assert len(buf) == 0
@@ -2,7 +2,6 @@
 Tests for Gate 4 safety mechanisms — circuit breaker and canary rollout.
 """
 
-import time
 from app.safety import CircuitBreaker, CanaryRollout
 
 
@@ -35,24 +34,48 @@ def test_cb_manual_reset():
 
 
 def test_cb_auto_reset_after_cooldown():
-    cb = CircuitBreaker(max_locks_in_window=1, window_seconds=60, cooldown_seconds=1)
+    clock = [0.0]
+    cb = CircuitBreaker(
+        max_locks_in_window=1, window_seconds=60, cooldown_seconds=1, time_fn=lambda: clock[0],
+    )
     cb.record_lock()
     assert cb.state == "OPEN"
-    time.sleep(1.1)
+    clock[0] += 1.2
     assert cb.state == "CLOSED"
 
 
 def test_cb_window_slides():
-    cb = CircuitBreaker(max_locks_in_window=3, window_seconds=1)
+    clock = [0.0]
+    cb = CircuitBreaker(max_locks_in_window=3, window_seconds=1, time_fn=lambda: clock[0])
     cb.record_lock()
     cb.record_lock()
-    time.sleep(1.1)
+    clock[0] += 1.2
     # Old timestamps should have expired
     cb.record_lock()
     assert cb.state == "CLOSED"
     assert cb.current_count == 1
 
 
+def test_cb_count_drops_expired_seconds_only():
+    clock = [0.0]
+    cb = CircuitBreaker(max_locks_in_window=10, window_seconds=3, time_fn=lambda: clock[0])
+    for _ in range(3):
+        cb.record_lock()
+        clock[0] += 1
+    assert cb.current_count == 2   # t=0 has slid out, t=1 and t=2 remain
+    clock[0] += 1
+    assert cb.current_count == 1
+
+
+def test_cb_check_and_record():
+    cb = CircuitBreaker(max_locks_in_window=2, window_seconds=60)
+    assert cb.check_and_record() is True
+    assert cb.check_and_record() is True
+    assert cb.state == "OPEN"
+    assert cb.check_and_record() is False
+    assert cb.current_count == 2
+
+
 # ── Canary Rollout Tests ──────────────────────────────────────────────
 
 def test_canary_start():
@@ -94,7 +117,7 @@ def test_canary_rollback_on_high_error_rate():
 
     result = cr.evaluate_and_advance(error_rate=0.05, heartbeat_loss_rate=0.01)
     assert result["status"] == "rolled_back"
-    assert "error rate" in result["reason"].lower()
+    assert result["reason"].startswith("Error rate 5.00%")
 
 
 def test_canary_rollback_on_heartbeat_loss():
@@ -103,7 +126,7 @@ def test_canary_rollback_on_heartbeat_loss():
 
     result = cr.evaluate_and_advance(error_rate=0.001, heartbeat_loss_rate=0.10)
     assert result["status"] == "rolled_back"
-    assert "heartbeat" in result["reason"].lower()
+    assert result["reason"].startswith("Heartbeat loss 10.00%")
 
 
 def test_canary_no_active_rollout():